@@ -1,35 +1,554 @@
+import ctypes
+import math
+import weakref
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+try:
+    from numba import cuda
+except ImportError:
+    cuda = None
+
 k = 8.99e+9
 
+# Number of pairs evaluated at once by Distribution.E_batch and the NumPy pair sum in Distribution.U.
+batch_size = 32768
+
+# Maximum number of particles per block in Distribution.E_batch. Large distributions are swept
+# a block at a time so that each block of pairs, and the scratch it is evaluated into, stays in cache.
+tile_particles = 4096
+
+# Maximum number of particles in a leaf of the Barnes-Hut tree, and maximum depth of the tree.
+tree_leaf_size = 8
+tree_max_depth = 32
+
+# Number of particles loaded into shared memory at a time by Distribution.E_batch_gpu (also the block size).
+gpu_tile_size = 128
+
+# Distributions with fewer particles than this are evaluated by single-threaded kernels, since starting
+# the worker threads costs more than the loop itself.
+parallel_min_size = 4096
+
+# Largest number of particles that Distribution.freeze unrolls into generated code.
+freeze_max_size = 16
+
+def aligned_empty(shape: int|tuple[int, ...], align: int = 64, dtype: type = np.float64) -> np.ndarray:
+    """
+    Return an uninitialized C-contiguous array whose data starts on an align-byte boundary.
+    """
+    dtype = np.dtype(dtype)
+    nbytes = (math.prod(shape) if isinstance(shape, (tuple, list)) else int(shape)) * dtype.itemsize
+    buffer = np.empty(nbytes + align, dtype=np.uint8)
+    offset = -buffer.ctypes.data % align
+    return buffer[offset:offset + nbytes].view(dtype).reshape(shape)
+
+# Fast-math without the no-NaNs and no-infinities assumptions, so a sample point sitting exactly on a particle
+# still comes back as inf or nan, which E, V, E_and_V, and U turn into ZeroDivisionError.
+_fastmath = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+# The kernels weight each particle by keep (0 or 1). Excluded particles also get 1 added to their r^2,
+# so a zero weight is never multiplied by the infinity from a sample point sitting on them.
+if njit is not None:
+    @njit(fastmath=_fastmath, cache=True)
+    def _serial_field_kernel(x, y, xs, ys, qs, keep):
+        E_x = qs.dtype.type(0)
+        E_y = qs.dtype.type(0)
+        one = qs.dtype.type(1)
+        for i in range(xs.shape[0]):
+            delta_x = x - xs[i]
+            delta_y = y - ys[i]
+            delta_r2 = delta_x * delta_x + delta_y * delta_y + (one - keep[i])
+            E_coef = keep[i] * qs[i] * delta_r2**qs.dtype.type(-1.5)
+            E_x += E_coef * delta_x
+            E_y += E_coef * delta_y
+        return (k * E_x, k * E_y)
+
+    @njit(fastmath=_fastmath, cache=True)
+    def _serial_potential_kernel(x, y, xs, ys, qs, keep):
+        V = qs.dtype.type(0)
+        one = qs.dtype.type(1)
+        for i in range(xs.shape[0]):
+            delta_x = x - xs[i]
+            delta_y = y - ys[i]
+            delta_r2 = delta_x * delta_x + delta_y * delta_y + (one - keep[i])
+            V += keep[i] * qs[i] * delta_r2**qs.dtype.type(-0.5)
+        return k * V
+
+    @njit(fastmath=_fastmath, cache=True)
+    def _serial_field_potential_kernel(x, y, xs, ys, qs, keep):
+        E_x = qs.dtype.type(0)
+        E_y = qs.dtype.type(0)
+        V = qs.dtype.type(0)
+        one = qs.dtype.type(1)
+        for i in range(xs.shape[0]):
+            delta_x = x - xs[i]
+            delta_y = y - ys[i]
+            inv_r = (delta_x * delta_x + delta_y * delta_y + (one - keep[i]))**qs.dtype.type(-0.5)
+            V_i = keep[i] * qs[i] * inv_r
+            E_coef = V_i * inv_r * inv_r
+            E_x += E_coef * delta_x
+            E_y += E_coef * delta_y
+            V += V_i
+        return (k * E_x, k * E_y, k * V)
+
+    # The parallel kernels run the serial kernel on blocks of particles, which prange spreads over the threads.
+    _parallel_block = 2048
+
+    @njit(parallel=True, fastmath=_fastmath, cache=True)
+    def _field_kernel(x, y, xs, ys, qs, keep):
+        n = xs.shape[0]
+        blocks = (n + _parallel_block - 1) // _parallel_block
+        parts = np.zeros((blocks, 2), dtype=qs.dtype)
+        for b in prange(blocks):
+            lo = b * _parallel_block
+            hi = min(lo + _parallel_block, n)
+            parts[b, 0], parts[b, 1] = _serial_field_kernel(x, y, xs[lo:hi], ys[lo:hi], qs[lo:hi], keep[lo:hi])
+        return (parts[:, 0].sum(), parts[:, 1].sum())
+
+    @njit(parallel=True, fastmath=_fastmath, cache=True)
+    def _potential_kernel(x, y, xs, ys, qs, keep):
+        n = xs.shape[0]
+        blocks = (n + _parallel_block - 1) // _parallel_block
+        parts = np.zeros((blocks, 1), dtype=qs.dtype)
+        for b in prange(blocks):
+            lo = b * _parallel_block
+            hi = min(lo + _parallel_block, n)
+            parts[b, 0] = _serial_potential_kernel(x, y, xs[lo:hi], ys[lo:hi], qs[lo:hi], keep[lo:hi])
+        return parts[:, 0].sum()
+
+    @njit(parallel=True, fastmath=_fastmath, cache=True)
+    def _field_potential_kernel(x, y, xs, ys, qs, keep):
+        n = xs.shape[0]
+        blocks = (n + _parallel_block - 1) // _parallel_block
+        parts = np.zeros((blocks, 3), dtype=qs.dtype)
+        for b in prange(blocks):
+            lo = b * _parallel_block
+            hi = min(lo + _parallel_block, n)
+            parts[b, 0], parts[b, 1], parts[b, 2] = _serial_field_potential_kernel(x, y, xs[lo:hi], ys[lo:hi], qs[lo:hi], keep[lo:hi])
+        return (parts[:, 0].sum(), parts[:, 1].sum(), parts[:, 2].sum())
+
+    @njit(parallel=True, fastmath=_fastmath, cache=True)
+    def _energy_kernel(xs, ys, qs):
+        U = qs.dtype.type(0)
+        for i in prange(xs.shape[0]):
+            for j in range(i + 1, xs.shape[0]):
+                delta_x = xs[i] - xs[j]
+                delta_y = ys[i] - ys[j]
+                U += qs[i] * qs[j] * (delta_x * delta_x + delta_y * delta_y)**qs.dtype.type(-0.5)
+        return k * U
+else:
+    # Scratch rows the NumPy kernels evaluate into, one buffer per dtype, grown to fit the largest distribution so far.
+    _scratch_rows: dict = {}
+
+    def _deltas(x, y, xs, ys, keep):
+        """
+        Fill the shared scratch rows with the displacements from each particle and the weighted r^2, instead of allocating.
+        The scratch rows are shared by every distribution, so E, V, and E_and_V must not be called from several threads at once.
+        """
+        n = xs.shape[0]
+        scratch = _scratch_rows.get(xs.dtype)
+        if scratch is None or scratch.shape[1] < n:
+            # The width stays a multiple of 16 so every row starts 64-byte aligned.
+            width = max(2 * scratch.shape[1] if scratch is not None else 0, -(-n // 16) * 16)
+            scratch = _scratch_rows[xs.dtype] = aligned_empty((4, width), dtype=xs.dtype)
+        scratch = scratch[:, :n]
+        delta_x, delta_y, delta_r2, temp = scratch
+        np.subtract(x, xs, out=delta_x)
+        np.subtract(y, ys, out=delta_y)
+        np.subtract(1, keep, out=delta_r2)
+        for delta in (delta_x, delta_y):
+            np.multiply(delta, delta, out=temp)
+            delta_r2 += temp
+        return scratch
+
+    def _field_kernel(x, y, xs, ys, qs, keep):
+        delta_x, delta_y, delta_r2, E_coef = _deltas(x, y, xs, ys, keep)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.power(delta_r2, -1.5, out=E_coef)
+            E_coef *= keep
+            E_coef *= qs
+            return (k * E_coef.dot(delta_x), k * E_coef.dot(delta_y))
+
+    def _potential_kernel(x, y, xs, ys, qs, keep):
+        delta_x, delta_y, delta_r2, V_coef = _deltas(x, y, xs, ys, keep)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.power(delta_r2, -0.5, out=V_coef)
+            V_coef *= keep
+            return k * V_coef.dot(qs)
+
+    def _field_potential_kernel(x, y, xs, ys, qs, keep):
+        delta_x, delta_y, E_coef, V_coef = _deltas(x, y, xs, ys, keep)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.power(E_coef, -0.5, out=V_coef)
+            np.multiply(V_coef, V_coef, out=E_coef)
+            V_coef *= keep
+            V_coef *= qs
+            E_coef *= V_coef
+            return (k * E_coef.dot(delta_x), k * E_coef.dot(delta_y), k * V_coef.sum())
+
+    def _energy_kernel(xs, ys, qs):
+        n = xs.shape[0]
+        U_tot = 0.0
+        step = max(1, math.isqrt(batch_size))
+        for i in range(0, n, step):
+            for j in range(i, n, step):
+                delta_x = xs[i:i + step, None] - xs[j:j + step]
+                delta_y = ys[i:i + step, None] - ys[j:j + step]
+                delta_r2 = delta_x * delta_x + delta_y * delta_y
+                if i == j:
+                    # A block against itself sees each pair twice, and each particle against itself once.
+                    np.fill_diagonal(delta_r2, np.inf)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    U_block = (qs[i:i + step, None] * qs[j:j + step] * delta_r2**-0.5).sum()
+                U_tot += k * (U_block / 2 if i == j else U_block)
+        return U_tot
+
+    _serial_field_kernel = _field_kernel
+    _serial_potential_kernel = _potential_kernel
+    _serial_field_potential_kernel = _field_potential_kernel
+
+# Optional native field kernel, built from field_kernel.c (see README). It is only used in place of the NumPy
+# fallback: it is no faster than the Numba kernels and runs on a single thread.
+_field_lib_path = Path(__file__).with_name("field_kernel.so")
+_field_lib = ctypes.CDLL(str(_field_lib_path)) if njit is None and _field_lib_path.exists() else None
+if _field_lib is not None:
+    # The arrays are passed as raw pointers, since checking them with np.ctypeslib.ndpointer costs more than the loop
+    # for small distributions. The particle rows and keep are always float64 and C-contiguous when this is called.
+    _double_ptr = ctypes.POINTER(ctypes.c_double)
+    _field_lib.field_eval_2d.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+        ctypes.c_double, ctypes.c_double,
+        _double_ptr, _double_ptr,
+    ]
+    _field_lib.field_eval_2d.restype = None
+
+    _numpy_field_kernel = _field_kernel
+
+    def _field_kernel(x, y, xs, ys, qs, keep):
+        if qs.dtype != np.float64:
+            return _numpy_field_kernel(x, y, xs, ys, qs, keep)
+        E_x = ctypes.c_double()
+        E_y = ctypes.c_double()
+        _field_lib.field_eval_2d(xs.ctypes.data, ys.ctypes.data, qs.ctypes.data, keep.ctypes.data, len(xs), x, y, E_x, E_y)
+        return (k * E_x.value, k * E_y.value)
+
+    _serial_field_kernel = _field_kernel
+
+# Per-block arithmetic of Distribution.E_batch and V_batch. work holds the displacements and r^2 of a block of
+# (sample point, particle) pairs followed by a free row, and totals the rows of the outputs for that block of sample points.
+def _field_block(work: np.ndarray, kqs: np.ndarray, totals: np.ndarray) -> None:
+    """
+    Add the electric field of a block of particles with charges kqs / k to totals.
+    """
+    *deltas, delta_r2, E_coef = work
+    np.power(delta_r2, -1.5, out=E_coef)
+    E_coef *= kqs
+    for delta, total in zip(deltas, totals):
+        delta *= E_coef
+        total += delta.sum(axis=1)
+
+def _potential_block(work: np.ndarray, kqs: np.ndarray, totals: np.ndarray) -> None:
+    """
+    Add the electric potential of a block of particles with charges kqs / k to totals.
+    """
+    *_, delta_r2, V_coef = work
+    np.power(delta_r2, -0.5, out=V_coef)
+    totals[0] += V_coef.dot(kqs)
+
+def _jit(**options):
+    """
+    Compile the function with Numba when it is available, otherwise leave it as plain Python.
+    """
+    if njit is None:
+        return lambda function: function
+    return njit(**options)
+
+def _build_tree(xs: np.ndarray, ys: np.ndarray, qs: np.ndarray) -> tuple:
+    """
+    Partition the particles into a quadtree stored as flat arrays with one entry per node.
+    Each node has the total charge of its particles, their center of charge (weighted by |q|),
+    their dipole moment about that center, the geometric center and width of its cell, and either up to 4 children (-1 if empty) or,
+    for leaves, the range of its particles in the returned sorted particle arrays.
+    """
+    children = []
+    node_q = []
+    node_cx = []
+    node_cy = []
+    node_px = []
+    node_py = []
+    node_gx = []
+    node_gy = []
+    node_w = []
+    node_start = []
+    node_count = []
+    order = []
+
+    def add_node(idx, gx, gy, w, depth):
+        node = len(node_q)
+        weights = np.abs(qs[idx])
+        weight_tot = weights.sum()
+        if weight_tot == 0:
+            weights = np.ones(len(idx))
+            weight_tot = len(idx)
+        children.append([-1] * 4)
+        node_q.append(qs[idx].sum())
+        node_cx.append((weights * xs[idx]).sum() / weight_tot)
+        node_cy.append((weights * ys[idx]).sum() / weight_tot)
+        node_px.append((qs[idx] * (xs[idx] - node_cx[node])).sum())
+        node_py.append((qs[idx] * (ys[idx] - node_cy[node])).sum())
+        node_gx.append(gx)
+        node_gy.append(gy)
+        node_w.append(w)
+        node_start.append(len(order))
+        node_count.append(0)
+        if len(idx) <= tree_leaf_size or depth == tree_max_depth:
+            order.extend(idx)
+            node_count[node] = len(idx)
+            return node
+        quadrants = (xs[idx] > gx) + 2 * (ys[idx] > gy)
+        for quadrant in range(4):
+            sub_idx = idx[quadrants == quadrant]
+            if len(sub_idx) > 0:
+                sub_gx = gx + (w / 4 if quadrant & 1 else -w / 4)
+                sub_gy = gy + (w / 4 if quadrant & 2 else -w / 4)
+                children[node][quadrant] = add_node(sub_idx, sub_gx, sub_gy, w / 2, depth + 1)
+        return node
+
+    lows = (xs.min(), ys.min())
+    highs = (xs.max(), ys.max())
+    w = max(high - low for low, high in zip(lows, highs)) or 1.0
+    add_node(np.arange(len(xs)), *((low + high) / 2 for low, high in zip(lows, highs)), w, 0)
+    order = np.array(order)
+    return (
+        np.array(children, dtype=np.int32),
+        np.array(node_q),
+        np.array(node_cx),
+        np.array(node_cy),
+        np.array(node_px),
+        np.array(node_py),
+        np.array(node_gx),
+        np.array(node_gy),
+        np.array(node_w),
+        np.array(node_start, dtype=np.int64),
+        np.array(node_count, dtype=np.int64),
+        np.ascontiguousarray(xs[order]),
+        np.ascontiguousarray(ys[order]),
+        np.ascontiguousarray(qs[order]),
+    )
+
+@_jit(fastmath=_fastmath)
+def _tree_kernel(x, y, skip, theta, children, node_q, node_cx, node_cy, node_px, node_py,
+                 node_gx, node_gy, node_w, node_start, node_count, xs, ys, qs):
+    """
+    Return the field components and potential at (x, y), without the factor of k, by walking the tree.
+    A node whose cell does not contain the point and satisfies width / distance < theta is treated as a single charge plus dipole.
+    The sorted particle with index skip is left out.
+    """
+    E_x = 0.0
+    E_y = 0.0
+    V = 0.0
+    stack = np.empty(4 * (tree_max_depth + 1), dtype=np.int64)
+    stack[0] = 0
+    top = 1
+    while top > 0:
+        top -= 1
+        node = stack[top]
+        half_w = 0.5 * node_w[node]
+        outside = abs(x - node_gx[node]) > half_w or abs(y - node_gy[node]) > half_w
+        delta_x = x - node_cx[node]
+        delta_y = y - node_cy[node]
+        delta_r2 = delta_x * delta_x + delta_y * delta_y
+        if outside and node_w[node] * node_w[node] < theta * theta * delta_r2:
+            inv_r = delta_r2**-0.5
+            inv_r3 = inv_r * inv_r * inv_r
+            p_dot_r = node_px[node] * delta_x + node_py[node] * delta_y
+            E_coef = (node_q[node] + 3 * p_dot_r * inv_r * inv_r) * inv_r3
+            E_x += E_coef * delta_x - node_px[node] * inv_r3
+            E_y += E_coef * delta_y - node_py[node] * inv_r3
+            V += node_q[node] * inv_r + p_dot_r * inv_r3
+        elif node_count[node] > 0:
+            for i in range(node_start[node], node_start[node] + node_count[node]):
+                if i != skip:
+                    delta_x = x - xs[i]
+                    delta_y = y - ys[i]
+                    inv_r = (delta_x * delta_x + delta_y * delta_y)**-0.5
+                    V_i = qs[i] * inv_r
+                    E_coef = V_i * inv_r * inv_r
+                    E_x += E_coef * delta_x
+                    E_y += E_coef * delta_y
+                    V += V_i
+        else:
+            for child in children[node]:
+                if child >= 0:
+                    stack[top] = child
+                    top += 1
+    return (E_x, E_y, V)
+
+@_jit(parallel=True, fastmath=_fastmath)
+def _tree_energy_kernel(theta, children, node_q, node_cx, node_cy, node_px, node_py,
+                        node_gx, node_gy, node_w, node_start, node_count, xs, ys, qs):
+    """
+    Return the potential energy of the particles, without the factor of k, by walking the tree once per particle.
+    """
+    U_double = 0.0
+    for i in prange(xs.shape[0]):
+        V = _tree_kernel(xs[i], ys[i], i, theta, children, node_q, node_cx, node_cy, node_px, node_py,
+                         node_gx, node_gy, node_w, node_start, node_count, xs, ys, qs)[2]
+        U_double += qs[i] * V
+    return U_double / 2
+
+if cuda is not None:
+    @cuda.jit(fastmath=True)
+    def _field_gpu_kernel(Xs, Ys, xs, ys, qs, E_x, E_y):
+        """
+        Sum the field at one sample point per thread, without the factor of k.
+        Each block cooperatively loads gpu_tile_size particles at a time into shared memory.
+        """
+        tile_xs = cuda.shared.array(gpu_tile_size, dtype=np.float64)
+        tile_ys = cuda.shared.array(gpu_tile_size, dtype=np.float64)
+        tile_qs = cuda.shared.array(gpu_tile_size, dtype=np.float64)
+        m = cuda.grid(1)
+        t = cuda.threadIdx.x
+        inside = m < Xs.shape[0]
+        x = Xs[m] if inside else 0.0
+        y = Ys[m] if inside else 0.0
+        E_x_m = 0.0
+        E_y_m = 0.0
+        n = xs.shape[0]
+        for start in range(0, n, gpu_tile_size):
+            if start + t < n:
+                tile_xs[t] = xs[start + t]
+                tile_ys[t] = ys[start + t]
+                tile_qs[t] = qs[start + t]
+            cuda.syncthreads()
+            if inside:
+                for j in range(min(gpu_tile_size, n - start)):
+                    delta_x = x - tile_xs[j]
+                    delta_y = y - tile_ys[j]
+                    inv_r = 1.0 / math.sqrt(delta_x * delta_x + delta_y * delta_y)
+                    E_coef = tile_qs[j] * inv_r * inv_r * inv_r
+                    E_x_m += E_coef * delta_x
+                    E_y_m += E_coef * delta_y
+            cuda.syncthreads()
+        if inside:
+            E_x[m] = E_x_m
+            E_y[m] = E_y_m
+
 class Particle:
+    __slots__ = ("_x", "_y", "_q", "_label", "_r", "_owners")
+
     def __init__(self, x: float, y: float, q: float, label: int|str = None) -> None:
         """
         Create a new particle of charge q at position (x, y).
         """
-        self.x = x
-        self.y = y
-        self.q = q
-        self.label = label
+        self._x = x
+        self._y = y
+        self._q = q
+        self._label = label
+        self._r: float = None
+        self._owners: list = None
 
     def __repr__(self) -> str:
         return f"Particle(x={self.x}, y={self.y}, q={self.q}, label={self.label})"
 
+    @property
+    def x(self) -> float:
+        return self._x
+
+    @x.setter
+    def x(self, x: float) -> None:
+        self._x = x
+        self._r = None
+        self._update_owners()
+
+    @property
+    def y(self) -> float:
+        return self._y
+
+    @y.setter
+    def y(self, y: float) -> None:
+        self._y = y
+        self._r = None
+        self._update_owners()
+
+    @property
+    def q(self) -> float:
+        return self._q
+
+    @q.setter
+    def q(self, q: float) -> None:
+        self._q = q
+        self._update_owners()
+
+    @property
+    def label(self) -> int|str:
+        return self._label
+
+    @label.setter
+    def label(self, label: int|str) -> None:
+        if label == self._label:
+            return
+        owners = self._live_owners()
+        for owner, _ in owners:
+            owner._check_label(label)
+        self._label = label
+        for owner, _ in owners:
+            owner._update_labels()
+
+    def _live_owners(self) -> list:
+        """
+        Return the (distribution, index) pairs of the distributions the particle was added to that still exist.
+        The particle only holds weak references to them, and forgets the ones that have been garbage collected.
+        """
+        if self._owners is None:
+            return []
+        owners = []
+        refs = []
+        for ref, idx in self._owners:
+            owner = ref()
+            if owner is not None:
+                owners.append((owner, idx))
+                refs.append((ref, idx))
+        self._owners = refs or None
+        return owners
+
+    def _update_owners(self) -> None:
+        """
+        Copy the particle's position and charge into the arrays of every distribution it is in.
+        """
+        for owner, idx in self._live_owners():
+            owner._update_particle(idx)
+
     @property
     def r(self) -> float:
         """
         Return the distance of the particle from the origin.
+        It is computed on first use and kept until the particle is moved.
         """
-        return (self.x**2 + self.y**2)**0.5
+        if self._r is None:
+            try:
+                self._r = math.hypot(self._x, self._y)
+            except TypeError:
+                self._r = np.hypot(self._x, self._y)
+        return self._r
 
     def E(self, x: float, y: float) -> tuple[float, float]:
         """
         Return the x and y components of the electric field at the specified (x, y) position.
         """
-        delta_x = x - self.x
-        delta_y = y - self.y
-        delta_r = (delta_x**2 + delta_y**2)**0.5
-        E_mag = k * self.q / delta_r**2
-        E_x = E_mag * (delta_x / delta_r)
-        E_y = E_mag * (delta_y / delta_r)
+        delta_x = x - self._x
+        delta_y = y - self._y
+        delta_r2 = delta_x * delta_x + delta_y * delta_y
+        E_coef = k * self._q * delta_r2**-1.5
+        E_x = E_coef * delta_x
+        E_y = E_coef * delta_y
         return (E_x, E_y)
 
     def V(self, x: float, y: float) -> float:
@@ -37,30 +556,52 @@ class Particle:
         Return the electric potential at the specified (x, y) position.
         Assume V -> 0 as r -> inf.
         """
-        delta_x = x - self.x
-        delta_y = y - self.y
-        delta_r = (delta_x**2 + delta_y**2)**0.5
-        V = k * self.q / delta_r
+        delta_x = x - self._x
+        delta_y = y - self._y
+        try:
+            delta_r = math.hypot(delta_x, delta_y)
+        except TypeError:
+            # Arrays of positions (e.g. a meshgrid) go through NumPy instead.
+            delta_r = np.hypot(delta_x, delta_y)
+        V = k * self._q / delta_r
         return V
 
 class Distribution:
-    def __init__(self, particles: list[Particle] = None) -> None:
+    def __init__(self, particles: list[Particle] = None, dtype: type = np.float64) -> None:
         """
         Create a new particle distribution.
+        The particle positions and charges are stored as dtype; np.float32 halves the memory traffic
+        of large grid evaluations at the cost of precision (about 7 significant digits).
         """
-        self.particles: list[Particle] = []
+        self._dtype = np.dtype(dtype)
+        self._particles: list[Particle] = []
+        self._label_to_idx: dict[int|str, int] = {}
+        self._soa = aligned_empty((4, 0), dtype=self._dtype)
+        self._xs, self._ys, self._qs, self._ones = self._soa
+        self._tree: tuple = None
+        self._gpu: tuple = None
+        self._frozen: tuple = None
+        self._theta = 0.5
         if particles is not None:
             self.add_particles(particles)
 
     def __repr__(self) -> str:
-        return f"Distribution({self.particles})"
-    
+        return f"Distribution({self._particles})"
+
+    @property
+    def particles(self) -> tuple[Particle, ...]:
+        """
+        Return the particles in the distribution.
+        This is a read-only view; use add_particle and add_particles to add more.
+        """
+        return tuple(self._particles)
+
     @property
     def labels(self) -> list[str]:
         """
         Return the list of non None particle labels in use.
         """
-        return [item.label for item in self.particles if item.label is not None]
+        return list(self._label_to_idx)
 
     def add_particle(self, particle: Particle) -> None:
         """
@@ -68,9 +609,48 @@ class Distribution:
         If the label is None, add it without issuse.
         If the label is not None, check that the label is not taken by another particle in the list.
         """
-        if particle.label in self.labels:
+        self._check_label(particle.label)
+        n = len(self._particles)
+        if n == self._soa.shape[1]:
+            # The capacity stays a multiple of 16 so every row of the buffer starts 64-byte aligned.
+            soa = aligned_empty((4, max(2 * n, 16)), dtype=self._dtype)
+            soa[:, :n] = self._soa[:, :n]
+            self._soa = soa
+        self._soa[:, n] = (particle.x, particle.y, particle.q, 1)
+        if particle.label is not None:
+            self._label_to_idx[particle.label] = n
+        self._particles.append(particle)
+        if particle._owners is None:
+            particle._owners = []
+        particle._owners.append((weakref.ref(self), n))
+        self._xs, self._ys, self._qs, self._ones = self._soa[:, :n + 1]
+        self._tree = None
+        self._gpu = None
+        self._frozen = None
+
+    def _check_label(self, label: int|str) -> None:
+        """
+        Raise ValueError if the label is not None and is taken by a particle in the distribution.
+        """
+        if label is not None and label in self._label_to_idx:
             raise ValueError("Particle label already in use.")
-        self.particles.append(particle)
+
+    def _update_labels(self) -> None:
+        """
+        Rebuild the label lookup after a particle's label is changed.
+        """
+        self._label_to_idx = {particle.label: idx for idx, particle in enumerate(self._particles) if particle.label is not None}
+
+    def _update_particle(self, idx: int) -> None:
+        """
+        Copy the particle at idx back into the arrays after it is moved or its charge is changed,
+        and drop the tree, frozen functions, and GPU copy built from the old values.
+        """
+        particle = self._particles[idx]
+        self._soa[:, idx] = (particle.x, particle.y, particle.q, 1)
+        self._tree = None
+        self._gpu = None
+        self._frozen = None
 
     def add_particles(self, particles: list[Particle]):
         """
@@ -83,45 +663,227 @@ class Distribution:
         """
         Get the particle with the given label.
         """
-        if label in self.labels:
-            for particle in self.particles:
-                if label == particle.label:
-                    return particle
-        else:
-            raise ValueError("Particle label not found.")
+        try:
+            return self._particles[self._label_to_idx[label]]
+        except KeyError:
+            raise ValueError("Particle label not found.") from None
+
+    def build_tree(self, theta: float = 0.5) -> None:
+        """
+        Build a Barnes-Hut tree of the current particles.
+        Until a particle is added or changed, E and V (without exclusions) and U treat each group of particles
+        whose width / distance < theta as a single charge plus dipole, which is much faster for large distributions but approximate.
+        Smaller theta is more accurate, and theta = 0 gives the exact result.
+        """
+        self._theta = theta
+        self._tree = _build_tree(self._xs, self._ys, self._qs) if self._particles else None
+
+    def freeze(self) -> None:
+        """
+        Generate E and V functions with the current particles unrolled and their values baked in as constants.
+        For small distributions evaluated many times this removes the per-call overhead of the array kernels.
+        Until a particle is added or changed, E and V without exclusions use the generated functions.
+        With Numba they are compiled with njit, the first time each is called.
+        """
+        n = len(self._particles)
+        if n > freeze_max_size:
+            raise ValueError("Too many particles to freeze.")
+        deltas = []
+        for i in range(n):
+            for c, values in zip("xy", (self._xs, self._ys)):
+                deltas.append(f"    delta_{c}{i} = {c} - {float(values[i])!r}")
+            deltas.append(f"    delta_r2_{i} = delta_x{i} * delta_x{i} + delta_y{i} * delta_y{i}")
+        kqs = [repr(float(k * q)) for q in self._qs]
+        E_terms = [f"    E_coef{i} = {kqs[i]} * delta_r2_{i}**-1.5" for i in range(n)]
+        E_sums = [" + ".join(f"E_coef{i} * delta_{c}{i}" for i in range(n)) or "0.0" for c in "xy"]
+        V_sum = " + ".join(f"{kqs[i]} * delta_r2_{i}**-0.5" for i in range(n)) or "0.0"
+        source = "\n".join([
+            "def E(x, y):",
+            *deltas,
+            *E_terms,
+            f"    return ({', '.join(E_sums)})",
+            "def V(x, y):",
+            *deltas,
+            f"    return {V_sum}",
+        ])
+        namespace = {}
+        exec(source, namespace)
+        self._frozen = (namespace["E"], namespace["V"])
+        if njit is not None:
+            self._frozen = tuple(njit(function) for function in self._frozen)
+
+    def to_gpu(self) -> None:
+        """
+        Copy the current particles to the GPU for E_batch_gpu.
+        The copy is dropped when a particle is added or changed.
+        """
+        if cuda is None or not cuda.is_available():
+            raise RuntimeError("CUDA is not available.")
+        self._gpu = tuple(cuda.to_device(item) for item in (self._xs, self._ys, self._qs))
+
+    def _keep(self, exclude: list[str] = None) -> np.ndarray:
+        """
+        Return the weight of each particle: 0 for those with the specified labels and 1 for the rest.
+        """
+        if not exclude:
+            return self._ones
+        keep = aligned_empty(len(self._ones), dtype=self._dtype)
+        keep.fill(1)
+        for label in exclude:
+            if label in self._label_to_idx:
+                keep[self._label_to_idx[label]] = 0
+        return keep
+
+    def _check_position(self, x: float, y: float, keep: np.ndarray) -> None:
+        """
+        Raise ZeroDivisionError, as Particle.E and V do, if (x, y) is exactly on a particle with nonzero keep.
+        Only called when a kernel returns inf or nan, so the usual case does not pay for the comparison.
+        """
+        if (((self._xs == x) & (self._ys == y)) & (keep != 0)).any():
+            raise ZeroDivisionError("Position coincides with a particle.")
 
     def E(self, x: float, y: float, exclude: list[str] = None) -> tuple[float, float]:
         """
         Return the x and y components of the electric field at the specified (x, y) position.
         Exclude the particles with the specifiecd labels.
+        If the coordinates are NumPy arrays, they are broadcast together and evaluated with E_batch.
+        """
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            return self.E_batch(x, y, exclude)
+        if self._frozen is not None and not exclude:
+            E_x, E_y = self._frozen[0](x, y)
+            if not math.isfinite(E_x + E_y):
+                self._check_position(x, y, self._ones)
+            return (E_x, E_y)
+        x, y = (self._dtype.type(x), self._dtype.type(y))
+        if self._tree is not None and not exclude:
+            keep = self._ones
+            E_x, E_y, _ = _tree_kernel(x, y, -1, self._theta, *self._tree)
+            E_x, E_y = (k * E_x, k * E_y)
+        else:
+            kernel = _field_kernel if len(self._particles) >= parallel_min_size else _serial_field_kernel
+            keep = self._keep(exclude)
+            E_x, E_y = kernel(x, y, self._xs, self._ys, self._qs, keep)
+        if not math.isfinite(E_x + E_y):
+            self._check_position(x, y, keep)
+        return (float(E_x), float(E_y))
+
+    def _sweep(self, Xs: np.ndarray, Ys: np.ndarray, exclude: list[str], outputs: int, block) -> tuple[np.ndarray, ...]:
+        """
+        Evaluate block (_field_block or _potential_block) over every pair of a broadcast sample position and a particle
+        that is not excluded, and return its outputs, each with the shape of the positions.
+        """
+        Xs, Ys = np.broadcast_arrays(*(np.asarray(item, dtype=self._dtype) for item in (Xs, Ys)))
+        shape = Xs.shape
+        Xs = Xs.reshape(-1, 1)
+        Ys = Ys.reshape(-1, 1)
+        kept = self._keep(exclude) != 0
+        xs = self._xs[kept]
+        ys = self._ys[kept]
+        kqs = k * self._qs[kept]
+        totals = np.zeros((outputs, Xs.shape[0]), dtype=self._dtype)
+        # Blocks of sample points are swept against blocks of particles, about batch_size pairs at a time,
+        # in scratch that is reused by every block.
+        width = max(1, min(tile_particles, len(xs)))
+        step = max(1, batch_size // width)
+        work = np.empty((4, min(step, Xs.shape[0]), min(width, len(xs))), dtype=self._dtype)
+        for m in range(0, Xs.shape[0], step):
+            points = slice(m, m + step)
+            for n in range(0, len(xs), width):
+                particles = slice(n, n + width)
+                block_work = work[:, :min(step, Xs.shape[0] - m), :min(width, len(xs) - n)]
+                delta_x, delta_y, delta_r2, temp = block_work
+                np.subtract(Xs[points], xs[particles], out=delta_x)
+                np.subtract(Ys[points], ys[particles], out=delta_y)
+                np.multiply(delta_x, delta_x, out=delta_r2)
+                np.multiply(delta_y, delta_y, out=temp)
+                delta_r2 += temp
+                block(block_work, kqs[particles], totals[:, points])
+        return tuple(total.reshape(shape) for total in totals)
+
+    def E_batch(self, Xs: np.ndarray, Ys: np.ndarray, exclude: list[str] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the x and y components of the electric field at each of the specified positions.
+        The coordinate arrays are broadcast together (e.g. a meshgrid), and each component has their shape.
+        Exclude the particles with the specifiecd labels.
+        """
+        return self._sweep(Xs, Ys, exclude, 2, _field_block)
+
+    def E_batch_gpu(self, Xs: np.ndarray, Ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the x and y components of the electric field at each of the specified positions, computed on the GPU.
+        The coordinate arrays are broadcast together (e.g. a meshgrid), and each component has their shape.
+        The particles are copied to the GPU first if to_gpu has not been called since the last one was added.
         """
-        if exclude is None:
-            exclude = []
-        E_tot_x = 0.0
-        E_tot_y = 0.0
-        for particle in self.particles:
-            if particle.label in exclude:
-                continue
-            E_x, E_y = particle.E(x, y)
-            E_tot_x += E_x
-            E_tot_y += E_y
-        return (E_tot_x, E_tot_y)
+        if self._gpu is None:
+            self.to_gpu()
+        Xs, Ys = np.broadcast_arrays(*(np.asarray(item, dtype=np.float64) for item in (Xs, Ys)))
+        shape = Xs.shape
+        Xs, Ys = (np.ascontiguousarray(item.ravel()) for item in (Xs, Ys))
+        M = Xs.shape[0]
+        E_x = cuda.device_array(M)
+        E_y = cuda.device_array(M)
+        blocks = max(1, (M + gpu_tile_size - 1) // gpu_tile_size)
+        _field_gpu_kernel[blocks, gpu_tile_size](cuda.to_device(Xs), cuda.to_device(Ys), *self._gpu, E_x, E_y)
+        return (k * E_x.copy_to_host().reshape(shape), k * E_y.copy_to_host().reshape(shape))
 
     def V(self, x: float, y: float, exclude: list[str] = None) -> float:
         """
         Return the electric potential at the specified (x, y) position.
         Exclude the particles with the specifiecd labels.
         Assume V -> 0 as r -> inf.
+        If the coordinates are NumPy arrays, they are broadcast together and evaluated with V_batch.
         """
-        if exclude is None:
-            exclude = []
-        V_tot = 0.0
-        for particle in self.particles:
-            if particle.label in exclude:
-                continue
-            V = particle.V(x, y)
-            V_tot += V
-        return V_tot
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            return self.V_batch(x, y, exclude)
+        if self._frozen is not None and not exclude:
+            V = self._frozen[1](x, y)
+            if not math.isfinite(V):
+                self._check_position(x, y, self._ones)
+            return V
+        x, y = (self._dtype.type(x), self._dtype.type(y))
+        if self._tree is not None and not exclude:
+            keep = self._ones
+            V = k * _tree_kernel(x, y, -1, self._theta, *self._tree)[2]
+        else:
+            kernel = _potential_kernel if len(self._particles) >= parallel_min_size else _serial_potential_kernel
+            keep = self._keep(exclude)
+            V = kernel(x, y, self._xs, self._ys, self._qs, keep)
+        if not math.isfinite(V):
+            self._check_position(x, y, keep)
+        return float(V)
+
+    def V_batch(self, Xs: np.ndarray, Ys: np.ndarray, exclude: list[str] = None) -> np.ndarray:
+        """
+        Return the electric potential at each of the specified positions.
+        The coordinate arrays are broadcast together (e.g. a meshgrid), and the result has their shape.
+        Exclude the particles with the specifiecd labels.
+        Assume V -> 0 as r -> inf.
+        """
+        return self._sweep(Xs, Ys, exclude, 1, _potential_block)[0]
+
+    def E_and_V(self, x: float, y: float, exclude: list[str] = None) -> tuple[tuple[float, float], float]:
+        """
+        Return both the electric field components and the electric potential at the specified (x, y) position.
+        This is a single pass over the particles, cheaper than calling E and V separately.
+        Exclude the particles with the specifiecd labels.
+        Assume V -> 0 as r -> inf.
+        If the coordinates are NumPy arrays, they are broadcast together and evaluated with E_batch and V_batch.
+        """
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            return (self.E_batch(x, y, exclude), self.V_batch(x, y, exclude))
+        x, y = (self._dtype.type(x), self._dtype.type(y))
+        if self._tree is not None and not exclude:
+            keep = self._ones
+            E_x, E_y, V = _tree_kernel(x, y, -1, self._theta, *self._tree)
+            E_x, E_y, V = (k * E_x, k * E_y, k * V)
+        else:
+            kernel = _field_potential_kernel if len(self._particles) >= parallel_min_size else _serial_field_potential_kernel
+            keep = self._keep(exclude)
+            E_x, E_y, V = kernel(x, y, self._xs, self._ys, self._qs, keep)
+        if not math.isfinite(E_x + E_y + V):
+            self._check_position(x, y, keep)
+        return ((float(E_x), float(E_y)), float(V))
 
     def F(self, label: str) -> tuple[float, float]:
         """
@@ -136,20 +898,22 @@ class Distribution:
         F_y = q * E_y
         return (F_x, F_y)
     
-    def U(self) -> float:
+    def U(self, hires: bool = True) -> float:
         """
         Return the electric potential energy of the distribution of particles.
         Assume U -> 0 as r -> inf.
+        Unless hires is False, the pair sum is done in float64 even for a float32 distribution,
+        since the positive and negative pair energies can largely cancel.
         """
-        U_tot_double = 0
-        particles = self.particles.copy()
-        for particle in particles:
-            q = particle.q
-            x = particle.x
-            y = particle.y
-            self.particles.remove(particle)
-            U = q * self.V(x, y)
-            U_tot_double += U
-            self.particles.append(particle)
-        U_tot = U_tot_double / 2
-        return U_tot
+        if self._tree is not None:
+            U = k * _tree_energy_kernel(self._theta, *self._tree)
+        else:
+            xs, ys, qs = self._xs, self._ys, self._qs
+            if hires:
+                xs, ys, qs = (item.astype(np.float64, copy=False) for item in (xs, ys, qs))
+            U = _energy_kernel(xs, ys, qs)
+        if not math.isfinite(U):
+            positions = np.stack((self._xs, self._ys), axis=1)
+            if len(np.unique(positions, axis=0)) < len(positions):
+                raise ZeroDivisionError("Two particles are at the same position.")
+        return float(U)
@@ -0,0 +1,197 @@
+import importlib.util
+import math
+import random
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+k = 8.99e+9
+
+def load(dim: int, name: str = None):
+    """
+    Import 2d_distribution.py or 3d_distribution.py, whose names are not valid module names.
+    """
+    name = name or f"distribution_{dim}d"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, ROOT / f"{dim}d_distribution.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+# Reference results, summed one particle at a time with the original formulas.
+# Each particle is a (position, q, label) tuple.
+def ref_E(particles, position, exclude=()):
+    E = [0.0] * len(position)
+    for particle_position, q, label in particles:
+        if label in exclude:
+            continue
+        deltas = [c - pc for c, pc in zip(position, particle_position)]
+        E_coef = k * q * sum(d * d for d in deltas)**-1.5
+        E = [E_c + E_coef * d for E_c, d in zip(E, deltas)]
+    return tuple(E)
+
+def ref_V(particles, position, exclude=()):
+    return sum(k * q / math.dist(position, particle_position) for particle_position, q, label in particles if label not in exclude)
+
+def ref_U(particles):
+    return sum(k * a[1] * b[1] / math.dist(a[0], b[0]) for i, a in enumerate(particles) for b in particles[i + 1:])
+
+class DistributionTests:
+    dim: int
+
+    def setUp(self):
+        self.module = load(self.dim)
+        rng = random.Random(self.dim)
+        self.values = [([rng.uniform(-1, 1) for _ in range(self.dim)], rng.uniform(-1e-6, 1e-6), i) for i in range(40)]
+        self.particles = [self.module.Particle(*position, q, label) for position, q, label in self.values]
+        self.dist = self.module.Distribution(self.particles)
+        self.point = [0.3, -0.2, 0.1][:self.dim]
+
+    def position(self, particle):
+        return [getattr(particle, c) for c in "xyz"[:self.dim]]
+
+    def refs(self):
+        return [(self.position(p), p.q, p.label) for p in self.particles]
+
+    def assertClose(self, actual, expected, tol=1e-9):
+        actual = actual if isinstance(actual, tuple) else (actual,)
+        expected = expected if isinstance(expected, tuple) else (expected,)
+        self.assertEqual(len(actual), len(expected))
+        for a, b in zip(actual, expected):
+            self.assertLessEqual(abs(float(a) - float(b)), tol * max(1.0, abs(b)), (actual, expected))
+
+    def assertMatchesReference(self, dist, exclude=()):
+        refs = self.refs()
+        self.assertClose(dist.E(*self.point, exclude=list(exclude)), ref_E(refs, self.point, exclude))
+        self.assertClose(dist.V(*self.point, exclude=list(exclude)), ref_V(refs, self.point, exclude))
+        E, V = dist.E_and_V(*self.point, exclude=list(exclude))
+        self.assertClose(E, ref_E(refs, self.point, exclude))
+        self.assertClose(V, ref_V(refs, self.point, exclude))
+
+    def test_matches_reference(self):
+        self.assertMatchesReference(self.dist)
+        self.assertClose(self.dist.U(), ref_U(self.refs()))
+
+    def test_exclude(self):
+        self.assertMatchesReference(self.dist, exclude=(3, 5, "missing"))
+
+    def test_force(self):
+        refs = self.refs()
+        particle = self.dist.get_particle(7)
+        expected = tuple(particle.q * E_c for E_c in ref_E(refs, self.position(particle), exclude=(7,)))
+        self.assertClose(self.dist.F(7), expected)
+
+    def test_parallel_kernels(self):
+        with mock.patch.object(self.module, "parallel_min_size", 1):
+            self.assertMatchesReference(self.dist, exclude=(2,))
+
+    def test_float32(self):
+        dist = self.module.Distribution(self.particles, dtype=np.float32)
+        refs = self.refs()
+        self.assertClose(dist.E(*self.point), ref_E(refs, self.point), tol=1e-4)
+        self.assertClose(dist.U(), ref_U(refs), tol=1e-6)
+
+    def test_move_particle(self):
+        self.dist.E(*self.point)
+        particle = self.particles[4]
+        particle.x = 0.25
+        particle.y = -0.5
+        if self.dim == 3:
+            particle.z = 0.75
+        self.assertMatchesReference(self.dist)
+        self.assertClose(self.dist.U(), ref_U(self.refs()))
+
+    def test_recharge_particle(self):
+        self.dist.build_tree(0)
+        self.particles[9].q = 5e-6
+        self.assertMatchesReference(self.dist)
+        E = ref_E(self.refs(), self.position(self.particles[9]), exclude=(9,))
+        self.assertClose(self.dist.F(9), tuple(5e-6 * E_c for E_c in E))
+
+    def test_relabel_particle(self):
+        particle = self.particles[6]
+        particle.label = "moved"
+        self.assertIs(self.dist.get_particle("moved"), particle)
+        with self.assertRaises(ValueError):
+            self.dist.get_particle(6)
+        with self.assertRaises(ValueError):
+            self.particles[8].label = "moved"
+        self.assertEqual(self.particles[8].label, 8)
+        self.assertMatchesReference(self.dist, exclude=("moved",))
+
+    def test_particle_in_two_distributions(self):
+        other = self.module.Distribution(self.particles[:10])
+        self.particles[0].q = 1e-6
+        self.assertClose(other.V(*self.point), ref_V(self.refs()[:10], self.point))
+        self.assertMatchesReference(self.dist)
+
+    def test_array_inputs(self):
+        grids = np.meshgrid(*[np.linspace(1.2, 1.8, 5)] * self.dim)
+        refs = self.refs()
+        E = self.dist.E(*grids, exclude=[1])
+        V = self.dist.V(*grids, exclude=[1])
+        (E2, V2) = self.dist.E_and_V(*grids, exclude=[1])
+        for idx in np.ndindex(grids[0].shape):
+            position = [float(grid[idx]) for grid in grids]
+            expected_E = ref_E(refs, position, exclude=(1,))
+            expected_V = ref_V(refs, position, exclude=(1,))
+            self.assertClose(tuple(component[idx] for component in E), expected_E)
+            self.assertClose(tuple(component[idx] for component in E2), expected_E)
+            self.assertClose(V[idx], expected_V)
+            self.assertClose(V2[idx], expected_V)
+        particle = self.particles[0]
+        self.assertEqual(particle.V(*grids).shape, grids[0].shape)
+
+    def test_exact_tree(self):
+        self.dist.build_tree(0)
+        refs = self.refs()
+        self.assertClose(self.dist.E(*self.point), ref_E(refs, self.point))
+        self.assertClose(self.dist.V(*self.point), ref_V(refs, self.point))
+        self.assertClose(self.dist.U(), ref_U(refs))
+
+    def test_freeze(self):
+        dist = self.module.Distribution(self.particles[:8])
+        dist.freeze()
+        refs = self.refs()[:8]
+        self.assertClose(dist.E(*self.point), ref_E(refs, self.point))
+        self.assertClose(dist.V(*self.point), ref_V(refs, self.point))
+
+    def test_position_on_particle(self):
+        position = self.values[2][0]
+        small = self.module.Distribution(self.particles[:8])
+        for dist in (self.dist, small):
+            for function in (dist.E, dist.V, dist.E_and_V):
+                with self.assertRaises(ZeroDivisionError):
+                    function(*position)
+        self.assertClose(self.dist.E(*position, exclude=[2]), ref_E(self.refs(), position, exclude=(2,)))
+        self.dist.build_tree(0)
+        small.freeze()
+        for dist in (self.dist, small):
+            with self.assertRaises(ZeroDivisionError):
+                dist.E(*position)
+
+    @unittest.skipUnless((ROOT / "field_kernel.so").exists(), "field_kernel.so is not built")
+    def test_native_kernel(self):
+        # The native kernel is only used without Numba, so load a copy of the module with Numba hidden.
+        with mock.patch.dict(sys.modules, {"numba": None}):
+            module = load(self.dim, f"distribution_{self.dim}d_native")
+        self.assertIsNotNone(module._field_lib)
+        dist = module.Distribution([module.Particle(*position, q, label) for position, q, label in self.values])
+        refs = self.refs()
+        self.assertClose(dist.E(*self.point), ref_E(refs, self.point))
+        self.assertClose(dist.E(*self.point, exclude=[3]), ref_E(refs, self.point, exclude=(3,)))
+
+class Distribution2DTests(DistributionTests, unittest.TestCase):
+    dim = 2
+
+class Distribution3DTests(DistributionTests, unittest.TestCase):
+    dim = 3
+
+if __name__ == "__main__":
+    unittest.main()